@@ -1,14 +1,16 @@
 from __future__ import annotations
 import argparse
+import atexit
 import copy
-import os
-from datetime import datetime
-from enum import Enum
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum, IntEnum
 from dataclasses import dataclass, field
-from time import sleep
+from time import monotonic, sleep
 from typing import Tuple, TypeVar, Type, Iterable, ClassVar
 import random
+import re
 import requests
+from requests.adapters import HTTPAdapter
 import sys
 from io import StringIO
 
@@ -18,19 +20,77 @@ max_time = 0
 max_turns = 0
 
 FILENAME = ''
+# game trace file, opened once by open_log() and shared by every write
+LOG_FILE = None
 
 # maximum and minimum values for our heuristic scores (usually represents an end of game condition)
 MAX_HEURISTIC_SCORE = 2000000000
 MIN_HEURISTIC_SCORE = -2000000000
 
+# bound stored with each transposition table entry, and the number of slots of the table (a prime)
+TT_EXACT = 0
+TT_LOWER = 1
+TT_UPPER = 2
+TT_SIZE = (1 << 20) + 7
+
+# half-width of the window around the previous depth's score that each deeper search starts with
+ASPIRATION_WINDOW = 10
+
+# maximum number of attacks and self-destructs the quiescence search follows past the search depth
+QUIESCENCE_MAX_DEPTH = 4
+
+# depth reduction of the search after a null move (passing the turn), and the fewest non-AI units it needs
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_UNITS = 2
+
+# seconds before the end of its time at which the search stops, and the number of nodes between two reads of the clock
+# (a power of 2)
+SEARCH_TIME_MARGIN = 0.5
+TIME_CHECK_INTERVAL = 1024
+
+# seconds below which a depth's search time is not trusted to predict the next one (a table hit can take almost none)
+MIN_DEPTH_SECONDS = 0.01
+
+# shallowest depth at which the root moves are split between worker processes: below it, searching a move takes less
+# than sending it to a worker and back
+ROOT_SPLIT_MIN_DEPTH = 5
+
+# maximum number of cached sum_of_positions results
+SPACING_CACHE_MAX_ENTRIES = 1 << 16
+
+# maximum number of cached evaluate_board results
+EVALUATION_CACHE_MAX_ENTRIES = 1 << 18
+
+# (connect, read) timeouts in seconds of the requests to the game broker
+BROKER_TIMEOUT = (1, 2)
+
 FILE_FLAG = True
 
-START_TIME = datetime.now()
+START_TIME = monotonic()
 TIME_HAS_STARTED = False
 
-TIME_ENDING_SOON = False
-class UnitType(Enum):
-    """Every unit type."""
+
+def open_log(filename: str):
+    """Open the game trace file in append mode for the rest of the program."""
+    global LOG_FILE
+    LOG_FILE = open(filename, "a", buffering=1 << 16)
+    atexit.register(LOG_FILE.close)
+
+
+def log(message: str):
+    """Append a message to the game trace file (if one was opened)."""
+    if LOG_FILE is not None:
+        LOG_FILE.write(message)
+
+
+def flush_log():
+    """Write the buffered game trace to the file, once per turn."""
+    if LOG_FILE is not None:
+        LOG_FILE.flush()
+
+
+class UnitType(IntEnum):
+    """Every unit type (usable directly as a table index)."""
     AI = 0
     Tech = 1
     Virus = 2
@@ -40,8 +100,8 @@ class UnitType(Enum):
     SelfDestruct = 5
 
 
-class Player(Enum):
-    """The 2 players."""
+class Player(IntEnum):
+    """The 2 players (usable directly as a table index)."""
     Attacker = 0
     Defender = 1
 
@@ -53,6 +113,35 @@ class Player(Enum):
             return Player.Attacker
 
 
+# number of distinct unit types (aliases excluded), used to index the per-type bitboards
+UNIT_TYPE_COUNT = len(UnitType)
+
+
+def _material_weights(player: Player) -> Tuple[Tuple[int, int], ...]:
+    """(bitboard index, weight) pairs giving the material term e0 of evaluate_board for a player.
+
+    e0 is 3 per Virus and Firewall and 999 per AI of the player, minus 3 per Firewall and Tech and 999 per AI of the
+    opponent, negated for the defender (the Program terms of both sides cancel out).
+    """
+    sign = 1 if player == Player.Attacker else -1
+    mine = player * UNIT_TYPE_COUNT
+    theirs = player.next() * UNIT_TYPE_COUNT
+    return ((mine + UnitType.Virus, 3 * sign), (mine + UnitType.Firewall, 3 * sign), (mine + UnitType.AI, 999 * sign),
+            (theirs + UnitType.Firewall, -3 * sign), (theirs + UnitType.Tech, -3 * sign),
+            (theirs + UnitType.AI, -999 * sign))
+
+
+# material weights of each player, applied to the unit counts of the per-type bitboards
+MATERIAL_WEIGHTS = tuple(_material_weights(player) for player in Player)
+
+# zobrist keys indexed by [cell][player][unit type][health] (boards up to 16x16), plus the Defender-to-play key
+# (seeded so that every process hashes a position the same way)
+_zobrist_random = random.Random(472)
+ZOBRIST_KEYS = [[[[_zobrist_random.getrandbits(64) for _ in range(10)] for _ in range(UNIT_TYPE_COUNT)]
+                 for _ in range(len(Player))] for _ in range(16 * 16)]
+ZOBRIST_SIDE = _zobrist_random.getrandbits(64)
+
+
 class GameType(Enum):
     AttackerVsDefender = 0
     AttackerVsComp = 1
@@ -60,6 +149,15 @@ class GameType(Enum):
     CompVsComp = 3
 
 
+class MoveKind(Enum):
+    """The action performed by a move."""
+    Invalid = 0
+    Move = 1
+    Combat = 2
+    Repair = 3
+    SelfDestruct = 4
+
+
 ##############################################################################################################
 
 
@@ -110,22 +208,27 @@ class Unit:
 
     def damage_amount(self, target: Unit) -> int:
         """How much can this unit damage another unit."""
-        amount = self.damage_table[self.type.value][target.type.value]
-        if target.health - amount < 0:
-            return target.health
-        return amount
+        return min(target.health, DAMAGE_TABLE[self.type][target.type])
 
     def repair_amount(self, target: Unit) -> int:
         """How much can this unit repair another unit."""
-        amount = self.repair_table[self.type.value][target.type.value]
-        if target.health + amount > 9:
-            return 9 - target.health
-        return amount
+        return min(9 - target.health, REPAIR_TABLE[self.type][target.type])
+
+
+# tuple copies of the unit tables, indexed by [source type][target type] without going through the class
+DAMAGE_TABLE = tuple(tuple(row) for row in Unit.damage_table)
+REPAIR_TABLE = tuple(tuple(row) for row in Unit.repair_table)
 
 
 ##############################################################################################################
 
 
+# lookups used to parse coordinates, and the separators ignored in typed moves
+_ROW_INDEX = {char: index for (index, char) in enumerate("ABCDEFGHIJKLMNOPQRSTUVWXYZ")}
+_COL_INDEX = {char: index for (index, char) in enumerate("0123456789abcdef")}
+_SEPARATORS = re.compile(r"[ ,.:;\-_]")
+
+
 @dataclass(slots=True)
 class Coord:
     """Representation of a game cell coordinate (row, col)."""
@@ -174,13 +277,11 @@ class Coord:
     @classmethod
     def from_string(cls, s: str) -> Coord | None:
         """Create a Coord from a string. ex: D2."""
-        s = s.strip()
-        for sep in " ,.:;-_":
-            s = s.replace(sep, "")
+        s = _SEPARATORS.sub("", s.strip())
         if (len(s) == 2):
             coord = Coord()
-            coord.row = "ABCDEFGHIJKLMNOPQRSTUVWXYZ".find(s[0:1].upper())
-            coord.col = "0123456789abcdef".find(s[1:2].lower())
+            coord.row = _ROW_INDEX.get(s[0].upper(), -1)
+            coord.col = _COL_INDEX.get(s[1].lower(), -1)
             return coord
         else:
             return None
@@ -226,20 +327,28 @@ class CoordPair:
     @classmethod
     def from_string(cls, s: str) -> CoordPair | None:
         """Create a CoordPair from a string. ex: A3 B2"""
-        s = s.strip()
-        for sep in " ,.:;-_":
-            s = s.replace(sep, "")
+        s = _SEPARATORS.sub("", s.strip())
         if (len(s) == 4):
             coords = CoordPair()
-            coords.src.row = "ABCDEFGHIJKLMNOPQRSTUVWXYZ".find(s[0:1].upper())
-            coords.src.col = "0123456789abcdef".find(s[1:2].lower())
-            coords.dst.row = "ABCDEFGHIJKLMNOPQRSTUVWXYZ".find(s[2:3].upper())
-            coords.dst.col = "0123456789abcdef".find(s[3:4].lower())
+            coords.src.row = _ROW_INDEX.get(s[0].upper(), -1)
+            coords.src.col = _COL_INDEX.get(s[1].lower(), -1)
+            coords.dst.row = _ROW_INDEX.get(s[2].upper(), -1)
+            coords.dst.col = _COL_INDEX.get(s[3].lower(), -1)
             return coords
         else:
             return None
 
 
+def pack_move(coords: CoordPair) -> int:
+    """Pack a move into an int (4 bits per row and column), as the search handles them."""
+    return (coords.src.row << 12) | (coords.src.col << 8) | (coords.dst.row << 4) | coords.dst.col
+
+
+def unpack_move(move: int) -> CoordPair:
+    """Create a CoordPair from a packed move."""
+    return CoordPair(Coord(move >> 12, (move >> 8) & 15), Coord((move >> 4) & 15, move & 15))
+
+
 ##############################################################################################################
 
 
@@ -255,6 +364,7 @@ class Options:
     max_turns: int | None = 100
     randomize_moves: bool = True
     broker: str | None = None
+    workers: int = 1
 
 
 ##############################################################################################################
@@ -271,21 +381,99 @@ class Stats:
 ##############################################################################################################
 
 
+@dataclass(slots=True)
+class Undo:
+    """Representation of the state overwritten by a move, used to take the move back."""
+    # (square, unit, health) of every cell the move may change
+    cells: list[Tuple[int, Unit | None, int]] = field(default_factory=list)
+    occupancy: list[int] = field(default_factory=list)
+    bitboards: list[int] = field(default_factory=list)
+    health: list[int] = field(default_factory=list)
+    ai_health: list[int] = field(default_factory=list)
+    next_player: Player = Player.Attacker
+    turns_played: int = 0
+    attacker_has_ai: bool = True
+    defender_has_ai: bool = True
+    zobrist_key: int = 0
+    kind: MoveKind = MoveKind.Invalid
+
+
+##############################################################################################################
+
+
+class SearchTimeout(Exception):
+    """Raised by the search when its deadline has passed."""
+
+
+##############################################################################################################
+
+
 @dataclass(slots=True)
 class Game:
     """Representation of the game state."""
-    board: list[list[Unit | None]] = field(default_factory=list)
+    # board cells, row by row: cell (row, col) is at index row * dim + col
+    _cells: list[Unit | None] = field(default_factory=list)
     next_player: Player = Player.Attacker
     turns_played: int = 0
     options: Options = field(default_factory=Options)
     stats: Stats = field(default_factory=Stats)
     _attacker_has_ai: bool = True
     _defender_has_ai: bool = True
+    _dim: int = 5
+    # bitboards mirroring the board: cell (row, col) maps to bit row * dim + col
+    _occupancy: list[int] = field(default_factory=list)
+    _bitboards: list[int] = field(default_factory=list)
+    # total health of each player's units, and of each player's AI (0 once destroyed), kept up to date by set/mod_health
+    _health: list[int] = field(default_factory=list)
+    _ai_health: list[int] = field(default_factory=list)
+    # the Coord of each cell (indexed by row * dim + col), shared by the tables below so the search allocates none
+    _coords: list[Coord] = field(default_factory=list)
+    # in-bounds neighbours of each cell (indexed by row * dim + col): the 4 adjacent cells, and the 3x3 area
+    _adjacent: list[Tuple[Coord, ...]] = field(default_factory=list)
+    _surrounding: list[Tuple[Coord, ...]] = field(default_factory=list)
+    # (destination, packed move) of every move from each cell: to the adjacent cells, then the self-destruct
+    _moves_from: list[Tuple[Tuple[Coord, int], ...]] = field(default_factory=list)
+    # bitboards of the cells whose column is lower than the index
+    _column_masks: list[int] = field(default_factory=list)
+    # sum_of_positions only depends on where a player's units are, so it is cached by occupancy bitboard
+    _spacing_cache: dict[int, float] = field(default_factory=dict)
+    # evaluate_board results, keyed by the Zobrist key of the board with the evaluated player to move
+    _evaluation_cache: dict[int, float] = field(default_factory=dict)
+    # incrementally updated hash of the board and the player to move
+    zobrist_key: int = 0
+    # entries (key, depth, score, bound, best move) stored in slot key % TT_SIZE
+    # (moves are packed, see pack_move)
+    transposition_table: dict[int, Tuple[int, int, float, int, int | None]] = field(default_factory=dict)
+    # the last 2 moves that caused a cutoff at each turn of the current search, tried right after the table's move
+    _killer_moves: dict[int, list[int]] = field(default_factory=dict)
+    # monotonic time at which the search raises SearchTimeout, and the number of nodes it has searched
+    _deadline: float = float('inf')
+    _node_count: int = 0
+    # HTTP session keeping the connection to the game broker open between turns (created on first use)
+    _broker_session: requests.Session | None = None
 
     def __post_init__(self):
         """Automatically called after class init to set up the default board state."""
         dim = self.options.dim
-        self.board = [[None for _ in range(dim)] for _ in range(dim)]
+        self._dim = dim
+        self._cells = [None] * (dim * dim)
+        self._occupancy = [0] * len(Player)
+        self._bitboards = [0] * (len(Player) * UNIT_TYPE_COUNT)
+        self._health = [0] * len(Player)
+        self._ai_health = [0] * len(Player)
+        self._coords = list(CoordPair.from_dim(dim).iter_rectangle())
+        self._adjacent = []
+        self._surrounding = []
+        self._moves_from = []
+        for coord in self._coords:
+            self._adjacent.append(tuple(self._coords[adj.row * dim + adj.col]
+                                        for adj in coord.iter_adjacent() if self.is_valid_coord(adj)))
+            self._surrounding.append(tuple(self._coords[adj.row * dim + adj.col]
+                                           for adj in coord.iter_range(1) if self.is_valid_coord(adj)))
+            self._moves_from.append(tuple((dst, pack_move(CoordPair(coord, dst)))
+                                          for dst in self._adjacent[-1] + (coord,)))
+        row_mask = sum(1 << (row * dim) for row in range(dim))
+        self._column_masks = [row_mask * ((1 << col) - 1) for col in range(dim + 1)]
         md = dim - 1
         self.set(Coord(0, 0), Unit(player=Player.Defender, type=UnitType.AI))
         self.set(Coord(1, 0), Unit(player=Player.Defender, type=UnitType.Tech))
@@ -301,40 +489,53 @@ class Game:
         self.set(Coord(md - 1, md - 1), Unit(player=Player.Attacker, type=UnitType.Firewall))
 
     def clone(self) -> Game:
-        """Make a new copy of a game for minimax recursion.
+        """Make a new copy of a game for the search.
 
-        Shallow copy of everything except the board (options and stats are shared).
+        Shallow copy of everything except the board (options and stats are shared). The slots are copied one by one,
+        which is about twice as fast as copy.copy going through __reduce_ex__.
         """
-        new = copy.copy(self)
-        new.board = copy.deepcopy(self.board)
+        new = object.__new__(Game)
+        for name in Game.__slots__:
+            setattr(new, name, getattr(self, name))
+        new._cells = [None if unit is None else Unit(unit.player, unit.type, unit.health) for unit in self._cells]
+        new._occupancy = self._occupancy[:]
+        new._bitboards = self._bitboards[:]
+        new._health = self._health[:]
+        new._ai_health = self._ai_health[:]
         return new
 
     def is_empty(self, coord: Coord) -> bool:
         """Check if contents of a board cell of the game at Coord is empty (must be valid coord)."""
-        return self.board[coord.row][coord.col] is None
+        return self._cells[coord.row * self._dim + coord.col] is None
 
     def get(self, coord: Coord) -> Unit | None:
         """Get contents of a board cell of the game at Coord."""
         if self.is_valid_coord(coord):
-            return self.board[coord.row][coord.col]
+            return self._cells[coord.row * self._dim + coord.col]
         else:
             return None
 
     def set(self, coord: Coord, unit: Unit | None):
         """Set contents of a board cell of the game at Coord."""
         if self.is_valid_coord(coord):
-            self.board[coord.row][coord.col] = unit
-
-    def remove_dead(self, coord: Coord):
-        """Remove unit at Coord if dead."""
-        unit = self.get(coord)
-        if unit is not None and not unit.is_alive():
-            self.set(coord, None)
-            if unit.type == UnitType.AI:
-                if unit.player == Player.Attacker:
-                    self._attacker_has_ai = False
-                else:
-                    self._defender_has_ai = False
+            square = coord.row * self._dim + coord.col
+            bit = 1 << square
+            old = self._cells[square]
+            if old is not None:
+                self._occupancy[old.player] &= ~bit
+                self._bitboards[old.player * UNIT_TYPE_COUNT + old.type] &= ~bit
+                self.zobrist_key ^= ZOBRIST_KEYS[square][old.player][old.type][old.health]
+                self._health[old.player] -= old.health
+                if old.type == UnitType.AI:
+                    self._ai_health[old.player] -= old.health
+            if unit is not None:
+                self._occupancy[unit.player] |= bit
+                self._bitboards[unit.player * UNIT_TYPE_COUNT + unit.type] |= bit
+                self.zobrist_key ^= ZOBRIST_KEYS[square][unit.player][unit.type][unit.health]
+                self._health[unit.player] += unit.health
+                if unit.type == UnitType.AI:
+                    self._ai_health[unit.player] += unit.health
+            self._cells[square] = unit
 
     def perform_repair(self, coords: CoordPair) -> Tuple[bool, str]:
         """Validate and perform a repair action expressed as a CoordPair."""
@@ -352,10 +553,10 @@ class Game:
         if repair_amount == 0:
             return False, 'Repair Action cannot be performed. No healing abilities'
         # Apply repair
-        dst_unit.mod_health(repair_amount)
+        self.mod_health(coords.dst, repair_amount)
         return True, f"{src_unit} repaired {dst_unit} for {repair_amount}"
 
-    def self_destruct(self, coord: Coord) -> Tuple[bool, str]:
+    def self_destruct(self, coord: Coord, silent: bool = False) -> Tuple[bool, str]:
         """Perform a self-destruct action at the specified Coord."""
         unit = self.get(coord)
         if unit is None:
@@ -364,76 +565,86 @@ class Game:
             return (False, "Cannot Destroy AI")
         # Damage surrounding units (including diagonals and friendly units)
 
-        for adj_coord in coord.iter_range(1):
+        for adj_coord in self._surrounding[coord.row * self._dim + coord.col]:
             target_unit = self.get(adj_coord)
             if target_unit is not None:
-                target_unit.mod_health(-2)
-                if target_unit.health > 2 and target_unit.player == Player.Attacker:
-                    if FILE_FLAG:
-                        with open(FILENAME, "a") as f:
-                            f.write(f'Attacking {target_unit.type.name} has lost 2 health points\n')
-                            f.close()
-                    print(f'Attacking {target_unit.type.name} has lost 2 health points')
-                elif target_unit.health > 2 and target_unit.player == Player.Defender:
-                    if FILE_FLAG:
-                        with open(FILENAME, "a") as f:
-                            f.write(f'Defending {target_unit.type.name} has lost 2 health points\n')
-                            f.close()
-                    print(f'Defending {target_unit.type.name} has lost 2 health points')
-                if target_unit.health <= 2 and target_unit.player == Player.Attacker:
-                    if FILE_FLAG:
-                        with open(FILENAME, "a") as f:
-                            f.write(f'Attacking {target_unit.type.name} has been killed\n')
-                            f.close()
-                    print(f'Attacking {target_unit.type.name} has been killed')
-                elif target_unit.health <= 2 and target_unit.player == Player.Defender:
+                self.mod_health(adj_coord, -2)
+                if FILE_FLAG or not silent:
+                    side = ('Attacking', 'Defending')[target_unit.player]
+                    outcome = 'has been killed' if target_unit.health <= 0 else 'has lost 2 health points'
+                    message = f'{side} {target_unit.type.name} {outcome}'
                     if FILE_FLAG:
-                        with open(FILENAME, "a") as f:
-                            f.write(f'Defending {target_unit.type.name} has been killed\n')
-                            f.close()
-                    print(f'Defending {target_unit.type.name} has been killed')
-                self.remove_dead(adj_coord)
+                        log(message + '\n')
+                    if not silent:
+                        print(message)
         # Remove the self-destruct unit from the board
         self.set(coord, None)
         return True, f"Self-destructed at {coord} and damaged surrounding units."
 
     def mod_health(self, coord: Coord, health_delta: int):
-        """Modify health of unit at Coord (positive or negative delta)."""
-        target = self.get(coord)
-        if target is not None:
-            target.mod_health(health_delta)
-            self.remove_dead(coord)
-
-    def combat(self, coords: CoordPair, unit: Unit, targetUnit: Unit) -> bool:
-        self.mod_health(coords.src, -abs(targetUnit.damage_amount(unit)))
-        self.mod_health(coords.dst, -abs(unit.damage_amount(targetUnit)))
+        """Modify health of unit at (valid) Coord (positive or negative delta), removing it if it dies."""
+        square = coord.row * self._dim + coord.col
+        target = self._cells[square]
+        if target is None:
+            return
+        health = target.health + health_delta
+        if health <= 0:
+            self.set(coord, None)
+            target.health = 0
+            if target.type == UnitType.AI:
+                if target.player == Player.Attacker:
+                    self._attacker_has_ai = False
+                else:
+                    self._defender_has_ai = False
+        else:
+            if health > 9:
+                health = 9
+            keys = ZOBRIST_KEYS[square][target.player][target.type]
+            self.zobrist_key ^= keys[target.health] ^ keys[health]
+            self._health[target.player] += health - target.health
+            if target.type == UnitType.AI:
+                self._ai_health[target.player] = health
+            target.health = health
+
+    def combat(self, coords: CoordPair, unit: Unit, targetUnit: Unit, silent: bool = False) -> bool:
+        damage_to_unit = -abs(targetUnit.damage_amount(unit))
+        damage_to_target = -abs(unit.damage_amount(targetUnit))
+        self.mod_health(coords.src, damage_to_unit)
+        self.mod_health(coords.dst, damage_to_target)
         if FILE_FLAG:
-            with open(FILENAME, "a") as f:
-                f.write(f'{unit.player.name} DAMAGE {unit.type.name} TO {targetUnit.type.name}: {-abs(targetUnit.damage_amount(unit))}\n{targetUnit.player.name} DAMAGE {targetUnit.type.name} TO {unit.type.name}: {-abs(unit.damage_amount(targetUnit))}\n')
-                f.close()
-        print(
-            f'{unit.player.name} DAMAGE {unit.type.name} TO {targetUnit.type.name}: {-abs(targetUnit.damage_amount(unit))}')
-        print(
-            f'{targetUnit.player.name} DAMAGE {targetUnit.type.name} TO {unit.type.name}: {-abs(unit.damage_amount(targetUnit))}')
+            log(f'{unit.player.name} DAMAGE {unit.type.name} TO {targetUnit.type.name}: {damage_to_unit}\n{targetUnit.player.name} DAMAGE {targetUnit.type.name} TO {unit.type.name}: {damage_to_target}\n')
+        if not silent:
+            print(
+                f'{unit.player.name} DAMAGE {unit.type.name} TO {targetUnit.type.name}: {damage_to_unit}')
+            print(
+                f'{targetUnit.player.name} DAMAGE {targetUnit.type.name} TO {unit.type.name}: {damage_to_target}')
         if targetUnit.health <= 0:
             return True
         return False
 
     def is_valid_move(self, coords: CoordPair) -> bool:
+        """Validate a move expressed as a CoordPair (without performing it)."""
+        return self.classify_move(coords)[0] is not MoveKind.Invalid
+
+    def classify_move(self, coords: CoordPair) -> Tuple[MoveKind, str]:
 
-        """Validate a move expressed as a CoordPair."""
+        """Find which action a move expressed as a CoordPair would perform, without changing the game.
+        Invalid moves come with the reason to report to the player (if any)."""
         if not self.is_valid_coord(coords.src) or not self.is_valid_coord(coords.dst):
-            return False
+            return (MoveKind.Invalid, "")
+
+        dim = self._dim
+        cells = self._cells
 
         """Get the source unit"""
-        src_unit = self.get(coords.src)
+        src_unit = cells[coords.src.row * dim + coords.src.col]
 
         """Check if the source unit exists and is of a valid player"""
         if src_unit is None or src_unit.player != self.next_player:
-            return False
+            return (MoveKind.Invalid, "")
 
         """Get the destination unit"""
-        dst_unit = self.get(coords.dst)
+        dst_unit = cells[coords.dst.row * dim + coords.dst.col]
 
         """Calculate the row and column differences between source and destination coordinates"""
         row_diff = coords.dst.row - coords.src.row
@@ -441,18 +652,16 @@ class Game:
 
         """Self-Destruct"""
         if row_diff == 0 and col_diff == 0:
-            result = self.self_destruct(coords.src)
-            if result[0]:
-                return 'SD'
-            print(result[1])
-            return False
+            if src_unit.type == UnitType.AI:
+                return (MoveKind.Invalid, "Cannot Destroy AI")
+            return (MoveKind.SelfDestruct, "")
 
         """Ensure that no diagonal movements are allowed"""
         if row_diff == 1 and col_diff == 1:
-            return False
+            return (MoveKind.Invalid, "")
         """Ensure that no diagonal movements are allowed"""
         if row_diff == -1 and col_diff == -1:
-            return False
+            return (MoveKind.Invalid, "")
 
         """Add movement restrictions based on player type and unit type"""
         if src_unit.player == Player.Attacker:
@@ -460,74 +669,122 @@ class Game:
                 """Attacker's Firewall, Program, and AI can only move up or left"""
                 if row_diff > 0 or col_diff > 0:
                     if dst_unit is None:
-                        return False
+                        return (MoveKind.Invalid, "")
         elif src_unit.player == Player.Defender:
             if src_unit.type in [UnitType.Firewall, UnitType.Program, UnitType.AI]:
                 """Defender's Firewall, Program, and AI can only move down or right"""
                 if row_diff < 0 or col_diff < 0:
                     if dst_unit is None:
-                        return False
+                        return (MoveKind.Invalid, "")
+
+        """Repair an allied unit, unless an opponent unit sits right above the player unit"""
+        if dst_unit is not None and dst_unit.player == self.next_player:
+            if coords.src.row > 0:
+                up_unit = cells[(coords.src.row - 1) * dim + coords.src.col]
+                if up_unit is not None and up_unit.player != src_unit.player:
+                    return (MoveKind.Invalid, "")
+            if dst_unit.health >= 9:
+                return (MoveKind.Invalid, "Unit's health is already full")
+            if src_unit.repair_amount(dst_unit) == 0:
+                return (MoveKind.Invalid, 'Repair Action cannot be performed. No healing abilities')
+            return (MoveKind.Repair, "")
 
         """Check if any opponent units are adjacent to the player unit"""
-        for adj_coord in coords.src.iter_adjacent():
-            adj_unit = self.get(adj_coord)
+        for adj_coord in self._adjacent[coords.src.row * dim + coords.src.col]:
+            adj_unit = cells[adj_coord.row * dim + adj_coord.col]
             if adj_unit is not None and adj_unit.player != src_unit.player:
-                if dst_unit is not None and dst_unit.player != self.next_player:
-                    movePiece = self.combat(coords, self.get(coords.src), self.get(coords.dst))
-                    if movePiece:
-                        return True
-                    return 'Damage'
-                return False
-            elif dst_unit is not None and dst_unit.player == self.next_player:
-                reparable = self.perform_repair(coords)
-                if reparable[0]:
-                    if FILE_FLAG:
-                        with open(FILENAME, "a") as f:
-                            f.write(reparable[1])
-                            f.close()
-                    print(reparable[1])
-                    return 'Repair'
-                print(reparable[1])
-                if FILE_FLAG:
-                    with open(FILENAME, "a") as f:
-                        f.write(reparable[1])
-                        f.close()
-                return False
-
-        """Check if the destination cell is empty or contains an opponent's unit"""
-        return dst_unit is None or dst_unit.player != self.next_player
-
-    def perform_move(self, coords: CoordPair) -> Tuple[bool, str]:
-        """Validate and perform a move expressed as a CoordPair."""
-        result = self.is_valid_move(coords)
-        if result is True:
+                if dst_unit is not None:
+                    return (MoveKind.Combat, "")
+                return (MoveKind.Invalid, "")
+
+        """The destination cell is empty or contains an opponent's unit"""
+        return (MoveKind.Move, "")
+
+    def apply_move(self, kind: MoveKind, coords: CoordPair, silent: bool = False) -> Tuple[bool, str]:
+        """Perform a move already classified by classify_move (printing what happens unless silent)."""
+        if kind is MoveKind.Move:
             self.set(coords.dst, self.get(coords.src))
             self.set(coords.src, None)
             return (True, "")
-        elif result == "Damage":
+        elif kind is MoveKind.Combat:
+            if self.combat(coords, self.get(coords.src), self.get(coords.dst), silent):
+                self.set(coords.dst, self.get(coords.src))
+                self.set(coords.src, None)
+                return (True, "")
             if FILE_FLAG:
-                with open(FILENAME, "a") as f:
-                    f.write('Combat has started\n')
-                    f.close()
+                log('Combat has started\n')
             return (True, "Damage")
-        elif result == "SD":
+        elif kind is MoveKind.SelfDestruct:
+            self.self_destruct(coords.src, silent)
             if FILE_FLAG:
-                with open(FILENAME, "a") as f:
-                    f.write('Self-Destruct has been performed\n')
-                    f.close()
+                log('Self-Destruct has been performed\n')
             return (True, "SD")
-        elif result == "Repair":
+        elif kind is MoveKind.Repair:
+            reparable = self.perform_repair(coords)
+            if FILE_FLAG:
+                log(reparable[1])
+            if not silent:
+                print(reparable[1])
             return (True, "Repair")
         return (False, "invalid move")
 
+    def perform_move(self, coords: CoordPair, silent: bool = False) -> Tuple[bool, str]:
+        """Validate and perform a move expressed as a CoordPair (printing what happens unless silent)."""
+        (kind, reason) = self.classify_move(coords)
+        if kind is MoveKind.Invalid and reason:
+            if not silent:
+                print(reason)
+            if FILE_FLAG:
+                log(reason + '\n')
+        return self.apply_move(kind, coords, silent)
+
+    def make_move(self, move: int) -> Undo | None:
+        """Silently perform a packed move in place and pass the turn, returning how to undo it (None if invalid)."""
+        dim = self._dim
+        cells = self._cells
+        coords = CoordPair(self._coords[(move >> 12) * dim + ((move >> 8) & 15)],
+                           self._coords[((move >> 4) & 15) * dim + (move & 15)])
+        (kind, _) = self.classify_move(coords)
+        if kind is MoveKind.Invalid:
+            return None
+        if coords.src == coords.dst:
+            touched = [coord.row * dim + coord.col for coord in self._surrounding[coords.src.row * dim + coords.src.col]]
+        else:
+            touched = (coords.src.row * dim + coords.src.col, coords.dst.row * dim + coords.dst.col)
+        undo = Undo([(square, cells[square], 0 if cells[square] is None else cells[square].health) for square in touched],
+                    self._occupancy[:], self._bitboards[:], self._health[:], self._ai_health[:],
+                    self.next_player, self.turns_played,
+                    self._attacker_has_ai, self._defender_has_ai, self.zobrist_key, kind)
+        self.apply_move(kind, coords, silent=True)
+        self.next_turn()
+        return undo
+
+    def unmake_move(self, undo: Undo):
+        """Restore the state saved by make_move."""
+        cells = self._cells
+        for (square, unit, health) in undo.cells:
+            if unit is not None:
+                unit.health = health
+            cells[square] = unit
+        self._occupancy = undo.occupancy
+        self._bitboards = undo.bitboards
+        self._health = undo.health
+        self._ai_health = undo.ai_health
+        self.next_player = undo.next_player
+        self.turns_played = undo.turns_played
+        self._attacker_has_ai = undo.attacker_has_ai
+        self._defender_has_ai = undo.defender_has_ai
+        self.zobrist_key = undo.zobrist_key
+
     def next_turn(self):
         """Transitions game to the next turn."""
         self.next_player = self.next_player.next()
         self.turns_played += 1
+        self.zobrist_key ^= ZOBRIST_SIDE
 
     def to_string(self) -> str:
         """Pretty text representation of the game."""
-        dim = self.options.dim
+        dim = self._dim
         output = ""
         output += f"Next player: {self.next_player.name}\n"
         output += f"Turns played: {self.turns_played}\n"
@@ -558,7 +815,7 @@ class Game:
 
     def is_valid_coord(self, coord: Coord) -> bool:
         """Check if a Coord is valid within out board dimensions."""
-        dim = self.options.dim
+        dim = self._dim
         if coord.row < 0 or coord.row >= dim or coord.col < 0 or coord.col >= dim:
             return False
         return True
@@ -567,9 +824,7 @@ class Game:
         """Read a move from keyboard and return as a CoordPair."""
         while True:
             s = input(F'Player {self.next_player.name}, enter your move: ')
-            with open(FILENAME, "a") as f:
-                f.write(F'{self.next_player.name}\'s move : {s} \n')
-                f.close()
+            log(F'{self.next_player.name}\'s move : {s} \n')
             coords = CoordPair.from_string(s)
             if coords is not None and self.is_valid_coord(coords.src) and self.is_valid_coord(coords.dst):
                 return coords
@@ -616,18 +871,14 @@ class Game:
             (success, result) = self.perform_move(mv)
             FILE_FLAG = True
             if success:
-                with open(FILENAME, "a") as f:
-                    f.write(f"Computer {self.next_player.name}: {mv}\n\n")
-                    f.close()
+                log(f"Computer {self.next_player.name}: {mv}\n\n")
                 print(f"Computer {self.next_player.name}: ", mv, end='',)
                 print('\n', result)
                 TIME_HAS_STARTED = False
                 self.next_turn()
             else:
-                print(f"{self.next_player} looses! The action performed is not valid!")
-                with open(FILENAME, "a") as f:
-                    f.write(f"{self.next_player} looses! The action performed is not valid!")
-                    f.close()
+                print(f"{self.next_player.name} looses! The action performed is not valid!")
+                log(f"{self.next_player.name} looses! The action performed is not valid!")
                 sys.exit()
         return mv
 
@@ -636,107 +887,82 @@ class Game:
 
     def player_units(self, player: Player) -> Iterable[Tuple[Coord, Unit]]:
         """Iterates over all units belonging to a player."""
-        for coord in CoordPair.from_dim(self.options.dim).iter_rectangle():
-            unit = self.get(coord)
-            if unit is not None and unit.player == player:
-                yield (coord, unit)
+        coords = self._coords
+        cells = self._cells
+        bb = self._occupancy[player]
+        while bb:
+            low = bb & -bb
+            bb ^= low
+            square = low.bit_length() - 1
+            yield (coords[square], cells[square])
 
     def sum_of_positions(self, player: Player) -> int:
-        """Iterates over all units belonging to a player."""
-        sum_of_spaces = 0
-        for coord in CoordPair.from_dim(self.options.dim).iter_rectangle():
-            unit = self.get(coord)
-            if unit is not None and unit.player == player and unit.health != 0:
-                up = None
-                down = None
-                left = None
-                right = None
-
-                for i in range(4):
-                    coord_down = self.get(Coord(coord.row + (i + 1), coord.col))
-                    if coord_down is not None and coord_down.player == player and down is None:
-                        if coord.row+(i+1) > 4:
-                            down = 0
-                        else:
-                            down = i
-                        #print('down', coord, i, Coord(coord.row+(i+1), coord.col))
-                    if i == 3 and down is None:
-                        down = 0
-
-                for i in range(4):
-                    coord_up = self.get(Coord(coord.row - (i + 1), coord.col))
-                    if coord_up is not None and coord_up.player == player and up is None:
-                        if coord.row-(i+1) < 0:
-                            up = 0
-                        else:
-                            up = i
-                        #print('up', coord, i, Coord(coord.row-(i+1), coord.col))
-                    elif i == 3 and up is None:
-                        up = 0
-
-                for i in range(4):
-                    coord_right = self.get(Coord(coord.row, coord.col + (i + 1)))
-                    if coord_right is not None and coord_right.player == player and right is None:
-                        if coord.col+(i+1) > 4:
-                            right = 0
-                        else:
-                            right = i
-                        #print('right', coord, i, Coord(coord.row, coord.col+(i+1)))
-                    if i == 3 and right is None:
-                        right = 0
-
-                for i in range(4):
-                    coord_left = self.get(Coord(coord.row, coord.col - (i + 1)))
-                    if coord_left is not None and coord_left.player == player and left is None:
-                        if coord.col - (i + 1) < 0:
-                            left = 0
-                        else:
-                            left = i
-                        #print('left', coord, i, Coord(coord.row, coord.col-(i+1)))
-                    if i == 3 and left is None:
-                        left = 0
-                maxi = max(right, left, up, down)
-                sum_of_spaces += maxi
-        sum_of_spaces /= 2
+        """Sum over a player's units of the widest gap (up to 4 cells) to the nearest ally in each direction, halved."""
+        occupancy = self._occupancy[player]
+        sum_of_spaces = self._spacing_cache.get(occupancy)
+        if sum_of_spaces is None:
+            if len(self._spacing_cache) >= SPACING_CACHE_MAX_ENTRIES:
+                self._spacing_cache.clear()
+            sum_of_spaces = self._sum_of_spaces(occupancy)
+            self._spacing_cache[occupancy] = sum_of_spaces
         return sum_of_spaces
 
+    def _sum_of_spaces(self, occupancy: int) -> float:
+        """Compute sum_of_positions for an occupancy bitboard."""
+        dim = self._dim
+        column_masks = self._column_masks
+        # units whose nearest ally in a direction (down, up, right, left) has already been found
+        found = [0, 0, 0, 0]
+        # units whose nearest ally, in at least one direction, is exactly i + 1 cells away
+        nearest_at = []
+        for distance in range(1, 5):
+            if distance < dim:
+                right_mask = column_masks[dim - distance]
+                left_mask = column_masks[dim] & ~column_masks[distance]
+            else:
+                right_mask = left_mask = 0
+            hits = (occupancy & (occupancy >> distance * dim),
+                    occupancy & (occupancy << distance * dim),
+                    occupancy & (occupancy >> distance) & right_mask,
+                    occupancy & (occupancy << distance) & left_mask)
+            nearest = 0
+            for direction in range(4):
+                nearest |= hits[direction] & ~found[direction]
+                found[direction] |= hits[direction]
+            nearest_at.append(nearest)
+        sum_of_spaces = 0
+        counted = 0
+        for distance in (4, 3, 2):
+            units = nearest_at[distance - 1] & ~counted
+            sum_of_spaces += (distance - 1) * units.bit_count()
+            counted |= units
+        return sum_of_spaces / 2
+
     def task_time(self):
-        return (datetime.now() - START_TIME).total_seconds()
+        return monotonic() - START_TIME
 
     def time_remaining(self):
         return self.options.max_time - self.task_time()
 
     def is_finished(self) -> bool:
-        """Check if the game is over."""
+        """Check if the search reached the end of the game: the turn limit, or an AI destroyed.
+
+        The time limit is left to has_winner in the game loop, the search stopping at its deadline before it.
+        """
         if self.options.max_turns is not None and self.turns_played >= self.options.max_turns:
             return True
-        if self.options.max_time is not None and self.options.max_time <= self.task_time():
-            winner = self.has_winner()
-            if winner is not None:
-                print(f"\n{winner.name} wins in {self.turns_played}!")
-                print(f'Total number of heuristic calculations : ', self.get_heuristics_count())
-                with open(FILENAME, "a") as f:
-                    f.write(f"\n{winner.name} wins in {self.turns_played}!")
-                    f.write(f'Total number of heuristic calculations : {self.get_heuristics_count()}')
-                    f.close()
-                sys.exit()
-            return True
-        return self.has_winner() is not None
+        return not (self._attacker_has_ai and self._defender_has_ai)
 
     def has_winner(self) -> Player | None:
         """Check if the game is over and returns winner"""
         if self.options.max_turns is not None and self.turns_played >= self.options.max_turns:
             print(f'gameTrace-{use_alpha_beta}-{max_time}-{max_turns}.txt')
-            with open(FILENAME, "a") as f:
-                f.write('\nThe maximum number of turns has passed. \n\nGAME ENDING...\n\n')
-                f.close()
+            log('\nThe maximum number of turns has passed. \n\nGAME ENDING...\n\n')
             print("\nThe maximum number of turns has passed. \nGAME ENDING... \n")
             return Player.Defender
 
         if self.options.max_time is not None and TIME_HAS_STARTED is True and self.options.max_time <= self.task_time():
-            with open(FILENAME, "a") as f:
-                f.write(f'\nThe maximum amount of time has passed. \n\nGAME ENDING...\n\n')
-                f.close()
+            log(f'\nThe maximum amount of time has passed. \n\nGAME ENDING...\n\n')
             print(f'\nThe maximum amount of time has passed. \nGAME ENDING... \n')
             if self.next_player == Player.Attacker:
                 return Player.Defender
@@ -749,27 +975,64 @@ class Game:
                 return Player.Attacker
         return Player.Defender
 
-    def move_candidates(self) -> Iterable[CoordPair]:
-        """Generate valid move candidates for the next player."""
+    def move_candidates(self) -> Iterable[int]:
+        """Generate valid move candidates for the next player, packed (see pack_move)."""
         move = CoordPair()
         for (src, _) in self.player_units(self.next_player):
             move.src = src
-            for dst in src.iter_adjacent():
+            for (dst, packed) in self._moves_from[src.row * self._dim + src.col]:
                 move.dst = dst
-                sys.stdout = open(os.devnull, 'w')
-                if self.clone().is_valid_move(move):
-                    yield move.clone()
-                    sys.stdout = sys.__stdout__
-                sys.stdout = sys.__stdout__
-            move.dst = src
-            yield move.clone()
+                if self.is_valid_move(move):
+                    yield packed
+
+    def candidate_moves(self) -> list[Tuple[int, int]]:
+        """Scored move candidates for the next player, most promising first.
+
+        The best move stored in the transposition table comes first, then the killer moves of this turn, then attacks
+        ranked by the damage traded and repairs ranked by the health restored, with ties going to moves that end closer
+        to the enemy AI.
+        """
+        dim = self._dim
+        cells = self._cells
+        enemy_ai = self._bitboards[self.next_player.next() * UNIT_TYPE_COUNT + UnitType.AI]
+        if enemy_ai:
+            (ai_row, ai_col) = divmod(enemy_ai.bit_length() - 1, dim)
+        entry = self.probe_transposition()
+        tt_move = entry[4] if entry is not None else None
+        killers = self._killer_moves.get(self.turns_played, ())
+        scored = []
+        for move in self.move_candidates():
+            if move == tt_move:
+                score = MAX_HEURISTIC_SCORE
+            elif move in killers:
+                score = MAX_HEURISTIC_SCORE - 1 - killers.index(move)
+            else:
+                score = 0
+                (dst_row, dst_col) = ((move >> 4) & 15, move & 15)
+                unit = cells[(move >> 12) * dim + ((move >> 8) & 15)]
+                target = cells[dst_row * dim + dst_col]
+                if target is not None and move >> 8 != move & 0xff:
+                    if target.player != unit.player:
+                        score = 10 * (unit.damage_amount(target) - target.damage_amount(unit))
+                    else:
+                        score = 5 * unit.repair_amount(target)
+                if enemy_ai:
+                    score -= abs(dst_row - ai_row) + abs(dst_col - ai_col)
+            scored.append((score, move))
+        scored.sort(key=lambda scored_move: scored_move[0], reverse=True)
+        return scored
 
     def random_move(self) -> Tuple[int, CoordPair | None, float]:
         """Returns a random move."""
-        move_candidates = list(self.move_candidates())
-        random.shuffle(move_candidates)
-        if len(move_candidates) > 0:
-            return (0, move_candidates[0], 1)
+        # reservoir sampling: the n-th candidate replaces the choice with probability 1/n
+        chosen = None
+        count = 0
+        for move in self.move_candidates():
+            count += 1
+            if random.randrange(count) == 0:
+                chosen = move
+        if chosen is not None:
+            return (0, unpack_move(chosen), 1)
         else:
             return (0, None, 0)
 
@@ -779,94 +1042,55 @@ class Game:
         """
         self.stats.heuristics_count += 1
 
-        #calculate the sum of spaces between allied units
+        # the same leaves are reached by many move orders, so scores are cached by Zobrist key
+        key = self.zobrist_key if player == self.next_player else self.zobrist_key ^ ZOBRIST_SIDE
+        score = self._evaluation_cache.get(key)
+        if score is None:
+            if len(self._evaluation_cache) >= EVALUATION_CACHE_MAX_ENTRIES:
+                self._evaluation_cache.clear()
+            score = self._evaluate(player)
+            self._evaluation_cache[key] = score
+        return score
+
+    def _evaluate(self, player: Player) -> int:
+        """Compute evaluate_board for a player."""
+        #calculate the sum of spaces between allied units (the score does not use the enemy's)
         ally_spacing_heuristic = self.sum_of_positions(player)
 
-        # calculate the sum of spaces between enemy units
-        enemy_spacing_heuristic = self.sum_of_positions(player.next())
+        # material: weighted unit counts, which are popcounts of the per-type bitboards
+        bitboards = self._bitboards
+        material = 0
+        for (index, weight) in MATERIAL_WEIGHTS[player]:
+            material += weight * bitboards[index].bit_count()
 
         # numb of player units
-        numb_heuristic1 = sum(
-            1 for coord, unit in self.player_units(player)
-        )
-
-        virus_attacker = sum(
-            1 for coord, unit in self.player_units(player) if unit.type == UnitType.Virus
-        )
-        tech_defender = sum(
-            1 for coord, unit in self.player_units(player.next()) if unit.type == UnitType.Tech
-        )
-
-        ai_attacker = sum(
-            1 for coord, unit in self.player_units(player) if unit.type == UnitType.AI
-        )
-
-        ai_defender = sum(
-            1 for coord, unit in self.player_units(player.next()) if unit.type == UnitType.AI
-        )
-
-        firewall_attacker = sum(
-            1 for coord, unit in self.player_units(player) if unit.type == UnitType.Firewall
-        )
-
-        firewall_defender = sum(
-            1 for coord, unit in self.player_units(player.next()) if unit.type == UnitType.Firewall
-        )
-
-        program_attacker = sum(
-            1 for coord, unit in self.player_units(player.next()) if unit.type == UnitType.Program
-        )
-
-        program_defender = sum(
-            1 for coord, unit in self.player_units(player.next()) if unit.type == UnitType.Program
-        )
+        numb_heuristic1 = self._occupancy[player].bit_count()
 
         # numb of opponent units
-        numb_heuristic2 = sum(
-            1 for coord, unit in self.player_units(player.next())
-        )
+        numb_heuristic2 = self._occupancy[player.next()].bit_count()
 
         # health of player units
-        health_heuristic1 = sum(
-            unit.health for coord, unit in self.player_units(player)
-        )
+        health_heuristic1 = self._health[player]
 
         # health of opponent units
-        health_heuristic2 = sum(
-            unit.health for coord, unit in self.player_units(player.next())
-        )
+        health_heuristic2 = self._health[player.next()]
 
         # health of ally AI
-        unit_health_ai = [unit.health for coord, unit in self.player_units(player) if unit.type == UnitType.AI]
+        unit_health_ai = self._ai_health[player]
 
         # health of opponent AI
-        opponent_health_ai = [unit.health for coord, unit in self.player_units(player) if
-                              unit.type == UnitType.AI]
+        opponent_health_ai = self._ai_health[player]
 
-        #sum of distances between attacking players
-
-
-        if not unit_health_ai:
-            unit_health_ai.append(0)  # Add an element to the list
-
-        if not opponent_health_ai:
-            opponent_health_ai.append(0)  # Add an element to the list
-
-        if unit_health_ai and opponent_health_ai:
-            if player == Player.Attacker:
-                e1 = (unit_health_ai[0] - opponent_health_ai[0]) * 10 + (numb_heuristic1 - numb_heuristic2) * 4 + (
-                        health_heuristic1 - health_heuristic2)
-                e0 = (3*virus_attacker + 3*firewall_attacker + 3*program_attacker + 999*ai_attacker)-(3*program_defender + 3*firewall_defender + 3*tech_defender + 999*ai_defender)
-                e2 = 2*e0 + ally_spacing_heuristic
-            elif player == Player.Defender:
-                e1 = (opponent_health_ai[0] - unit_health_ai[0]) * 10 + (numb_heuristic2 - numb_heuristic1) * 4 + (
-                        health_heuristic2 - health_heuristic1)
-                e0 = (3 * program_defender + 3 * firewall_defender + 3 * tech_defender + 999 * ai_defender)-(3 * virus_attacker + 3 * firewall_attacker + 3 * program_attacker + 999 * ai_attacker)
-                e2 = 2*e0 - ally_spacing_heuristic
-            else:
-                e1 = 0
-                e0 = 0
-                e2 = 0
+        if player == Player.Attacker:
+            e1 = (unit_health_ai - opponent_health_ai) * 10 + (numb_heuristic1 - numb_heuristic2) * 4 + (
+                    health_heuristic1 - health_heuristic2)
+            e0 = material
+            e2 = 2*e0 + ally_spacing_heuristic
+        elif player == Player.Defender:
+            e1 = (opponent_health_ai - unit_health_ai) * 10 + (numb_heuristic2 - numb_heuristic1) * 4 + (
+                    health_heuristic2 - health_heuristic1)
+            e0 = material
+            e2 = 2*e0 - ally_spacing_heuristic
         else:
             e1 = 0
             e0 = 0
@@ -874,82 +1098,271 @@ class Game:
 
         return e2
 
-    def minimax(self, depth, player, alpha, beta, use_alpha_beta) -> Tuple[int, CoordPair | None]:
-        """
-        Perform the minimax search with alpha-beta pruning.
+    def negamax(self, depth, alpha, beta, color, use_alpha_beta, allow_null=False) -> Tuple[int, int | None]:
         """
-        global TIME_ENDING_SOON
+        Perform the negamax search with alpha-beta pruning.
 
-        if depth == 0 or self.is_finished():
-            return self.evaluate_board(player, depth), None
+        Scores are from the point of view of the player to move: color is 1 when it is the attacker (whose score is
+        maximized) and -1 when it is the defender, so a single code path handles both sides.
+
+        When allow_null is set (anywhere below the root, but not right after a null move), the node is cut off if
+        passing the turn still scores at least beta in a shallower search.
+
+        Raises SearchTimeout once the deadline has passed, leaving the board in the middle of the searched line.
+        """
+        self._node_count += 1
+        if self._node_count & (TIME_CHECK_INTERVAL - 1) == 0 and monotonic() > self._deadline:
+            raise SearchTimeout()
+
+        finished = self.is_finished()
+        # without pruning the quiescence search would follow every exchange, so plain minimax uses the static score
+        if depth == 0 and use_alpha_beta and not finished:
+            return self.quiescence(alpha, beta, color, QUIESCENCE_MAX_DEPTH), None
+        if depth == 0 or finished:
+            return color * self.evaluate_board(self.next_player, depth), None
+
+        entry = self.probe_transposition()
+        if entry is not None and entry[1] >= depth:
+            (_, _, score, bound, move) = entry
+            if bound == TT_EXACT:
+                return score, move
+            elif bound == TT_LOWER:
+                alpha = max(alpha, score)
+            else:
+                beta = min(beta, score)
+            if alpha >= beta:
+                return score, move
+
+        if allow_null and use_alpha_beta and depth >= 3 and self.has_null_move_material():
+            self.next_player = self.next_player.next()
+            self.zobrist_key ^= ZOBRIST_SIDE
+            score, _ = self.negamax(depth - 1 - NULL_MOVE_REDUCTION, -beta, -beta + 1, -color, use_alpha_beta)
+            self.next_player = self.next_player.next()
+            self.zobrist_key ^= ZOBRIST_SIDE
+            if -score >= beta:
+                return -score, None
+
+        alpha_start = alpha
+        beta_start = beta
         best_move = None
 
-        if player == Player.Attacker:
-            best_score = MIN_HEURISTIC_SCORE
-            for move in self.move_candidates():
-                new_game = self.clone()
-                sys.stdout = open(os.devnull, 'w')
-                result, message = new_game.perform_move(move)
-                sys.stdout = sys.__stdout__
-
-                score, _ = new_game.minimax(depth - 1, player.next(), alpha, beta, use_alpha_beta)
-                if result is True:
-                    if score > best_score:
-                        best_score = score
-                        best_move = move
-
-                    alpha = max(alpha, best_score)
-                    if use_alpha_beta and beta <= alpha:
-                        break
-                    if self.time_remaining() < 0.5:
-                        TIME_ENDING_SOON = True
-                        break
+        best_score = MIN_HEURISTIC_SCORE
+        for (_, move) in self.candidate_moves():
+            undo = self.make_move(move)
+            if undo is None:
+                continue
+
+            score, _ = self.negamax(depth - 1, -beta, -alpha, -color, use_alpha_beta, allow_null=True)
+            score = -score
+            self.unmake_move(undo)
+            if score > best_score:
+                best_score = score
+                best_move = move
+
+            alpha = max(alpha, best_score)
+            if use_alpha_beta and beta <= alpha:
+                self.store_killer(move)
+                break
+
+        # a search cut short by the clock raises before getting here, so only complete results are stored
+        if not use_alpha_beta or alpha_start < best_score < beta_start:
+            bound = TT_EXACT
+        elif best_score <= alpha_start:
+            bound = TT_UPPER
         else:
-            best_score = MAX_HEURISTIC_SCORE
-            for move in self.move_candidates():
-                new_game = self.clone()
-                sys.stdout = open(os.devnull, 'w')
-                result, message = new_game.perform_move(move)
-                sys.stdout = sys.__stdout__
-
-                score, _ = new_game.minimax(depth - 1, player.next(), alpha, beta, use_alpha_beta)
-
-                if result is True:
-                    if score < best_score:
-                        best_score = score
-                        best_move = move
-
-                        beta = min(beta, best_score)
-                        if use_alpha_beta and beta <= alpha:
-                            break
-
-                    if self.time_remaining() < 0.5:
-                        TIME_ENDING_SOON = True
+            bound = TT_LOWER
+        self.store_transposition(depth, best_score, bound, best_move)
+        return best_score, best_move
+
+    def has_null_move_material(self) -> bool:
+        """Check if the player to move has enough units besides its AI for a null move to be safe."""
+        player = self.next_player
+        units = self._occupancy[player] & ~self._bitboards[player * UNIT_TYPE_COUNT + UnitType.AI]
+        return units.bit_count() >= NULL_MOVE_MIN_UNITS
+
+    def quiescence(self, alpha, beta, color, depth) -> int:
+        """
+        Extend the alpha-beta search past its depth with attacks and self-destructs only, until the position is quiet.
+
+        The static evaluation stands in for the moves that are not followed, so a leaf is not scored in the middle of
+        an exchange (the horizon effect). Scores are from the point of view of the player to move, as in negamax.
+        """
+        self._node_count += 1
+        if self._node_count & (TIME_CHECK_INTERVAL - 1) == 0 and monotonic() > self._deadline:
+            raise SearchTimeout()
+
+        stand_pat = color * self.evaluate_board(self.next_player, 0)
+        if depth == 0 or self.is_finished():
+            return stand_pat
+        if stand_pat >= beta:
+            return stand_pat
+        best_score = stand_pat
+        alpha = max(alpha, stand_pat)
+        for move in self.tactical_moves():
+            undo = self.make_move(move)
+            if undo is None:
+                continue
+            score = -self.quiescence(-beta, -alpha, -color, depth - 1)
+            self.unmake_move(undo)
+            if score > best_score:
+                best_score = score
+            alpha = max(alpha, best_score)
+            if beta <= alpha:
+                break
+        return best_score
+
+    def tactical_moves(self) -> list[int]:
+        """Attacks, and self-destructs that damage an enemy, of the next player, best damage trade first."""
+        dim = self._dim
+        cells = self._cells
+        scored = []
+        for move in self.move_candidates():
+            src = (move >> 12) * dim + ((move >> 8) & 15)
+            unit = cells[src]
+            if move >> 8 == move & 0xff:
+                for coord in self._surrounding[src]:
+                    target = cells[coord.row * dim + coord.col]
+                    if target is not None and target.player != unit.player:
+                        scored.append((0, move))
                         break
+            else:
+                target = cells[((move >> 4) & 15) * dim + (move & 15)]
+                if target is not None and target.player != unit.player:
+                    scored.append((unit.damage_amount(target) - target.damage_amount(unit), move))
+        scored.sort(key=lambda scored_move: scored_move[0], reverse=True)
+        return [move for (_, move) in scored]
+
+    def search_root(self, depth, alpha, beta, color, use_alpha_beta) -> Tuple[int, int | None]:
+        """
+        Search the current position like negamax, splitting the root moves between worker processes if enabled.
+
+        The most promising move is searched here first, so that the other moves can be searched in parallel with its
+        score as a bound (young brothers wait). Each worker keeps its own transposition table between searches.
+
+        The workers do not share their tables or improve each other's bound, so the split search evaluates more
+        positions than a single process. Its results depend on which worker searched which moves before, so it can
+        choose different moves than a single process, or than another run.
+        """
+        if self.options.workers <= 1 or depth < ROOT_SPLIT_MIN_DEPTH or self.is_finished():
+            return self.negamax(depth, alpha, beta, color, use_alpha_beta)
+        moves = [move for (_, move) in self.candidate_moves()]
+        if len(moves) < 2:
+            return self.negamax(depth, alpha, beta, color, use_alpha_beta)
+
+        undo = self.make_move(moves[0])
+        score, _ = self.negamax(depth - 1, -beta, -alpha, -color, use_alpha_beta, allow_null=True)
+        self.unmake_move(undo)
+        best_score, best_move = (-score, moves[0])
+        alpha = max(alpha, best_score)
+        if use_alpha_beta and beta <= alpha:
+            return best_score, best_move
+
+        # workers get the board without the caches, which they do not need and would be slow to send
+        root = self.clone()
+        root.transposition_table = {}
+        root._spacing_cache = {}
+        root._evaluation_cache = {}
+        root._killer_moves = {}
+        root._broker_session = None
+        pool = search_pool(self.options.workers)
+        futures = [pool.submit(search_root_move, root, move, depth, alpha, beta, color, use_alpha_beta, START_TIME)
+                   for move in moves[1:]]
+        timed_out = False
+        for (move, future) in zip(moves[1:], futures):
+            (score, heuristics_count, move_timed_out) = future.result()
+            self.stats.heuristics_count += heuristics_count
+            timed_out = timed_out or move_timed_out
+            if not timed_out and score > best_score:
+                best_score, best_move = (score, move)
+        if timed_out:
+            raise SearchTimeout()
         return best_score, best_move
 
+    def probe_transposition(self) -> Tuple[int, int, float, int, int | None] | None:
+        """Transposition table entry of the current position (None if it is not in the table)."""
+        entry = self.transposition_table.get(self.zobrist_key % TT_SIZE)
+        if entry is not None and entry[0] == self.zobrist_key:
+            return entry
+        return None
+
+    def store_transposition(self, depth: int, score: float, bound: int, best_move: int | None):
+        """Store a search result of the current position, unless its slot holds a deeper result for another one."""
+        slot = self.zobrist_key % TT_SIZE
+        entry = self.transposition_table.get(slot)
+        if entry is None or entry[0] == self.zobrist_key or entry[1] <= depth:
+            self.transposition_table[slot] = (self.zobrist_key, depth, score, bound, best_move)
+
+    def store_killer(self, move: int):
+        """Remember a move that caused a cutoff at the current turn, keeping the 2 most recent ones."""
+        killers = self._killer_moves.setdefault(self.turns_played, [])
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[2:]
+
     def suggest_move(self, use_alpha_beta) -> CoordPair | None:
         """
-        Suggest the next move using minimax alpha-beta pruning.
+        Suggest the next move using negamax alpha-beta pruning, deepening one level at a time.
+
+        Each depth fills the transposition table used to order the moves of the next one, and starts with a narrow
+        window around the previous depth's score (searched again with the full window if the score falls outside).
+        The move kept is the one from the deepest search that completed (the most promising move if no depth
+        completed).
         """
         global START_TIME
         global TIME_HAS_STARTED
-        global TIME_ENDING_SOON
 
         TIME_HAS_STARTED = True
-        START_TIME = datetime.now()
-        _, move = self.minimax(self.options.max_depth, self.next_player, MIN_HEURISTIC_SCORE, MAX_HEURISTIC_SCORE, use_alpha_beta)
-        if TIME_ENDING_SOON:
+        START_TIME = monotonic()
+        self._killer_moves.clear()
+        if self.options.max_time is not None:
+            self._deadline = START_TIME + self.options.max_time - SEARCH_TIME_MARGIN
+        # the search runs on a copy of the board, as a timeout leaves it in the middle of a line
+        search = self.clone()
+        color = 1 if self.next_player == Player.Attacker else -1
+        score, move = (MIN_HEURISTIC_SCORE, None)
+        timed_out = False
+        previous_seconds = 0.0
+        for depth in range(1, self.options.max_depth + 1):
+            depth_start = self.task_time()
+            aspiring = use_alpha_beta and move is not None
+            if aspiring:
+                (alpha, beta) = (color * score - ASPIRATION_WINDOW, color * score + ASPIRATION_WINDOW)
+            else:
+                (alpha, beta) = (MIN_HEURISTIC_SCORE, MAX_HEURISTIC_SCORE)
+            try:
+                depth_score, depth_move = search.search_root(depth, alpha, beta, color, use_alpha_beta)
+                if aspiring and not alpha < depth_score < beta:
+                    depth_score, depth_move = search.search_root(depth, MIN_HEURISTIC_SCORE, MAX_HEURISTIC_SCORE,
+                                                                 color, use_alpha_beta)
+            except SearchTimeout:
+                timed_out = True
+                break
+            score, move = (color * depth_score, depth_move)
+            # stop if the next depth, growing like this one did, would not finish in time
+            depth_seconds = self.task_time() - depth_start
+            growth = depth_seconds / max(previous_seconds, MIN_DEPTH_SECONDS)
+            if self.time_remaining() - SEARCH_TIME_MARGIN < depth_seconds * max(growth, 1.0):
+                break
+            previous_seconds = depth_seconds
+        if timed_out:
             print('\n\nQUICK, TIME IS RUNNING OUT...\n\n')
-            TIME_ENDING_SOON = False
-        print("Heuristic score: ", _)
+            if move is None:
+                move = next((candidate for (_, candidate) in self.candidate_moves()), None)
+        print("Heuristic score: ", score)
         elapsed_seconds = self.task_time()
         self.stats.total_seconds += elapsed_seconds
-        with open(FILENAME, "a") as f:
-            f.write(f'Action performed in : {elapsed_seconds} seconds\nHeuristic score : {_} \n')
-            f.close()
+        log(f'Action performed in : {elapsed_seconds} seconds\nHeuristic score : {score} \n')
         print('Action performed in :', elapsed_seconds, ' seconds')
-        return move
+        return None if move is None else unpack_move(move)
+
+    def broker_session(self) -> requests.Session:
+        """HTTP session used for every request to the game broker."""
+        if self._broker_session is None:
+            self._broker_session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+            self._broker_session.mount("http://", adapter)
+            self._broker_session.mount("https://", adapter)
+        return self._broker_session
 
     def post_move_to_broker(self, move: CoordPair):
         """Send a move to the game broker."""
@@ -961,12 +1374,13 @@ class Game:
             "turn": self.turns_played
         }
         try:
-            r = requests.post(self.options.broker, json=data)
-            if r.status_code == 200 and r.json()['success'] and r.json()['data'] == data:
+            r = self.broker_session().post(self.options.broker, json=data, timeout=BROKER_TIMEOUT)
+            body = r.json()
+            if r.status_code == 200 and body['success'] and body['data'] == data:
                 # print(f"Sent move to broker: {move}")
                 pass
             else:
-                print(f"Broker error: status code: {r.status_code}, response: {r.json()}")
+                print(f"Broker error: status code: {r.status_code}, response: {body}")
         except Exception as error:
             print(f"Broker error: {error}")
 
@@ -976,9 +1390,10 @@ class Game:
             return None
         headers = {'Accept': 'application/json'}
         try:
-            r = requests.get(self.options.broker, headers=headers)
-            if r.status_code == 200 and r.json()['success']:
-                data = r.json()['data']
+            r = self.broker_session().get(self.options.broker, headers=headers, timeout=BROKER_TIMEOUT)
+            body = r.json()
+            if r.status_code == 200 and body['success']:
+                data = body['data']
                 if data is not None:
                     if data['turn'] == self.turns_played + 1:
                         move = CoordPair(
@@ -995,7 +1410,7 @@ class Game:
                     # print("Got no data from broker")
                     pass
             else:
-                print(f"Broker error: status code: {r.status_code}, response: {r.json()}")
+                print(f"Broker error: status code: {r.status_code}, response: {body}")
         except Exception as error:
             print(f"Broker error: {error}")
         return None
@@ -1004,6 +1419,49 @@ class Game:
 ##############################################################################################################
 
 
+# processes searching root moves in parallel (created on first use), and the transposition table of a worker process
+SEARCH_POOL = None
+WORKER_TRANSPOSITION_TABLE = {}
+
+
+def search_pool(workers: int) -> ProcessPoolExecutor:
+    """Pool of worker processes used by Game.search_root, shut down when the program exits.
+
+    Every process is started when the pool is created, so that no search pays for it.
+    """
+    global SEARCH_POOL
+    if SEARCH_POOL is None:
+        SEARCH_POOL = ProcessPoolExecutor(max_workers=workers)
+        atexit.register(SEARCH_POOL.shutdown, cancel_futures=True)
+        for future in [SEARCH_POOL.submit(int) for _ in range(workers)]:
+            future.result()
+    return SEARCH_POOL
+
+
+def search_root_move(game: Game, move: int, depth: int, alpha, beta, color: int, use_alpha_beta: bool,
+                     start_time: float) -> Tuple[int, int, bool]:
+    """Search a root move in a worker process, returning its score, the heuristics computed and if time ran out."""
+    global START_TIME
+    global TIME_HAS_STARTED
+    global FILE_FLAG
+
+    # the monotonic clock is shared by all processes, so the worker's deadline (copied with the game) is the same
+    START_TIME = start_time
+    TIME_HAS_STARTED = True
+    FILE_FLAG = False
+    game.transposition_table = WORKER_TRANSPOSITION_TABLE
+    heuristics_count = game.stats.heuristics_count
+    game.make_move(move)
+    try:
+        score, _ = game.negamax(depth - 1, -beta, -alpha, -color, use_alpha_beta, allow_null=True)
+    except SearchTimeout:
+        return (MIN_HEURISTIC_SCORE, game.stats.heuristics_count - heuristics_count, True)
+    return (-score, game.stats.heuristics_count - heuristics_count, False)
+
+
+##############################################################################################################
+
+
 def main():
     # Get game options from the user
     game_type = input("Choose game type (auto|attacker|defender|manual): ")
@@ -1016,10 +1474,9 @@ def main():
     global FILENAME
     # If you want to append data to an existing file, use 'a' mode
     FILENAME = f'gameTrace-{use_alpha_beta}-{max_time}-{max_turns}.txt'
-    with open(FILENAME, "a") as f:
-        f.write('START OF THE GAME!.\n\n')
-        f.write(f'Game Type: {game_type}\n\nDepth Of Search Tree : {max_depth}\n\nMaximum Time : {max_time}!\n\nMaximum turns : {max_turns}\n\nUse alpha beta : {use_alpha_beta}\n\n\n')
-        f.close()
+    open_log(FILENAME)
+    log('START OF THE GAME!.\n\n')
+    log(f'Game Type: {game_type}\n\nDepth Of Search Tree : {max_depth}\n\nMaximum Time : {max_time}!\n\nMaximum turns : {max_turns}\n\nUse alpha beta : {use_alpha_beta}\n\n\n')
     # Parse command line arguments
     parser = argparse.ArgumentParser(
         prog='ai_wargame',
@@ -1028,6 +1485,7 @@ def main():
     parser.add_argument('--max_time', type=float, default="300", help='maximum search time')
     parser.add_argument('--game_type', type=str, default="manual", help='game type: auto|attacker|defender|manual')
     parser.add_argument('--broker', type=str, help='play via a game broker')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes searching the AI moves')
     args = parser.parse_args()
     args.game_type = game_type
     args.max_time = max_time
@@ -1053,6 +1511,11 @@ def main():
         options.max_time = args.max_time
     if args.broker is not None:
         options.broker = args.broker
+    if args.workers is not None:
+        options.workers = args.workers
+    # start the worker processes before any search is timed
+    if options.workers > 1:
+        search_pool(options.workers)
 
     # Create a new game
     game = Game(options=options)
@@ -1063,19 +1526,14 @@ def main():
     while True:
         print()
         print(game)
-        with open(FILENAME, "a") as f:
-            f.write(str(game))
-            f.write('\n')
-            f.close()
+        log(f'{game}\n')
 
         winner = game.has_winner()
         if winner is not None:
             print(f'Total Heuristics Calculations:', game.get_heuristics_count())
             print(f"\n{winner.name} wins in {game.turns_played}!")
-            with open(FILENAME, "a") as f:
-                f.write(f'Total Heuristics Calculations: {game.get_heuristics_count()}')
-                f.write(f"\n{winner.name} wins in {game.turns_played}!")
-                f.close()
+            log(f'Total Heuristics Calculations: {game.get_heuristics_count()}')
+            log(f"\n{winner.name} wins in {game.turns_played}!")
             break
         if game.options.game_type == GameType.AttackerVsDefender:
             game.human_turn()
@@ -1093,22 +1551,19 @@ def main():
                     winner = Player.Defender
                 else:
                     winner = Player.Attacker
-                with open(FILENAME, "a") as f:
-                    f.write(f'\nThe maximum amount of time has passed. \n\nGAME ENDING...\n\n')
-                    f.write(f"\n{winner.name} wins in {game.turns_played}!")
-                    f.close()
+                log(f'\nThe maximum amount of time has passed. \n\nGAME ENDING...\n\n')
+                log(f"\n{winner.name} wins in {game.turns_played}!")
                 print(f'\nThe maximum amount of time has passed. \nGAME ENDING... \n')
                 print(f"\n{winner.name} wins in {game.turns_played}!")
 
                 """"
-                with open(FILENAME, "a") as f:
-                    f.write("Computer doesn't know what to do!!!")
-                    f.write(f'Total Heuristics Calculations: {game.get_heuristics_count()}')
-                    f.close()
+                log("Computer doesn't know what to do!!!")
+                log(f'Total Heuristics Calculations: {game.get_heuristics_count()}')
                 print("Computer doesn't know what to do!!!")
                 print(f'Total Heuristics Calculations:', game.get_heuristics_count())
                 """
                 exit(1)
+        flush_log()
 
 
 ##############################################################################################################